@@ -13,22 +13,68 @@
 # limitations under the License.
 
 import logging
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
 
-from synapse.util.async_helpers import Linearizer
+import attr
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+from synapse.logging.context import PreserveLoggingContext, make_deferred_yieldable
+from synapse.util.async_helpers import Linearizer, ObservableDeferred
+from synapse.util.caches.response_cache import ResponseCache
 
 if TYPE_CHECKING:
     from synapse.server import HomeServer
 
 logger = logging.getLogger(__name__)
 
+# If an update has waited this long for the read marker linearizer, and a later
+# update for the same user is queued behind it, we hand its event on to that
+# update rather than doing the database work ourselves. The event is held in
+# memory until the next update takes the lock and writes the later of the two
+# events; the stale update then returns (or fails) with the outcome of that write.
+STALE_READ_MARKER_UPDATE_MS = 5 * 1000
+
+
+@attr.s(slots=True, auto_attribs=True)
+class _HandedOnReadMarker:
+    """A read marker handed on by one or more stale updates to the next update
+    for the same room and user.
+    """
+
+    event_id: str
+
+    # Resolved by the update which writes the marker, with the outcome of that
+    # write. The stale updates which handed the marker on wait on this.
+    result: "ObservableDeferred[None]" = attr.Factory(
+        lambda: ObservableDeferred(defer.Deferred(), consumeErrors=True)
+    )
+
 
 class ReadMarkerHandler:
     def __init__(self, hs: "HomeServer"):
         self.server_name = hs.config.server.server_name
+        self.clock = hs.get_clock()
         self.store = hs.get_datastores().main
         self.account_data_handler = hs.get_account_data_handler()
-        self.read_marker_linearizer = Linearizer(name="read_marker")
+        self.read_marker_linearizer = Linearizer(name="read_marker", clock=self.clock)
+
+        # Clients frequently send the same read marker several times in quick
+        # succession. Identical in-flight updates share the result of the first
+        # one rather than each queueing up on the linearizer to do the same work.
+        self._update_response_cache: ResponseCache[
+            Tuple[str, str, str]
+        ] = ResponseCache(hs.get_clock(), "read_marker_update")
+
+        # Maps (room_id, user_id) to the read marker handed on by stale updates to
+        # the update queued behind them. The next update to take the lock writes
+        # whichever of its own event and the handed on one is later in the stream.
+        #
+        # Nothing cancels a queued update once it has handed on a marker, as they
+        # run in the background via the response cache, so the next update is
+        # always there to pick it up.
+        self._handed_on_read_markers: Dict[Tuple[str, str], _HandedOnReadMarker] = {}
 
     async def received_client_read_marker(
         self, room_id: str, user_id: str, event_id: str
@@ -39,22 +85,111 @@ class ReadMarkerHandler:
         This uses a notifier to indicate that account data should be sent down /sync if
         the read marker has changed.
         """
-
-        async with self.read_marker_linearizer.queue((room_id, user_id)):
+        if (room_id, user_id) not in self._handed_on_read_markers:
+            # Clients frequently re-send their current read marker, which we can
+            # answer without taking the lock. The account data cache is
+            # invalidated on every worker whenever the marker is changed or
+            # purged (e.g. on deactivation), so this is normally served from it.
             existing_read_marker = await self.store.get_account_data_for_room_and_type(
                 user_id, room_id, "m.fully_read"
             )
+            if existing_read_marker and existing_read_marker["event_id"] == event_id:
+                return
 
-            should_update = True
+        await self._update_response_cache.wrap(
+            (room_id, user_id, event_id),
+            self._update_read_marker,
+            room_id,
+            user_id,
+            event_id,
+        )
 
-            if existing_read_marker:
-                # Only update if the new marker is ahead in the stream
-                should_update = await self.store.is_event_after(
-                    event_id, existing_read_marker["event_id"]
-                )
+    async def _update_read_marker(
+        self, room_id: str, user_id: str, event_id: str
+    ) -> None:
+        key = (room_id, user_id)
+        queued_at = self.clock.time_msec()
+        async with self.read_marker_linearizer.queue(key):
+            handed_on = self._handed_on_read_markers.pop(key, None)
+            if handed_on is not None:
+                try:
+                    if await self.store.is_event_after(handed_on.event_id, event_id):
+                        event_id = handed_on.event_id
+                except Exception:
+                    # Our own event is unknown, but the handed on one has been
+                    # checked: write it anyway so that the stale updates waiting
+                    # on it get the real outcome, then fail this update.
+                    await self._write_handed_on_read_marker(
+                        room_id, user_id, handed_on.event_id, handed_on
+                    )
+                    raise
 
-            if should_update:
-                content = {"event_id": event_id}
-                await self.account_data_handler.add_account_data_to_room(
-                    user_id, room_id, "m.fully_read", content
+            if not (
+                self.clock.time_msec() - queued_at > STALE_READ_MARKER_UPDATE_MS
+                and self.read_marker_linearizer.is_queued(key)
+            ):
+                await self._write_handed_on_read_marker(
+                    room_id, user_id, event_id, handed_on
                 )
+                return
+
+            if handed_on is None:
+                # Check the event exists, so that an unknown event fails this
+                # update rather than the one we hand it on to.
+                await self.store.get_event_ordering(event_id)
+                handed_on = _HandedOnReadMarker(event_id)
+            else:
+                handed_on.event_id = event_id
+
+            logger.info(
+                "Handing on stale read marker update for %s in %s", user_id, room_id
+            )
+            self._handed_on_read_markers[key] = handed_on
+            result = handed_on.result.observe()
+
+        # Wait for the update we handed on to, outside of the lock so that it can
+        # run.
+        await make_deferred_yieldable(result)
+
+    async def _write_handed_on_read_marker(
+        self,
+        room_id: str,
+        user_id: str,
+        event_id: str,
+        handed_on: Optional[_HandedOnReadMarker],
+    ) -> None:
+        """Writes the read marker, passing the outcome on to any stale updates
+        waiting on `handed_on`.
+        """
+        try:
+            await self._write_read_marker_if_newer(room_id, user_id, event_id)
+        except Exception:
+            if handed_on is not None:
+                with PreserveLoggingContext():
+                    handed_on.result.errback(Failure())
+            raise
+
+        if handed_on is not None:
+            with PreserveLoggingContext():
+                handed_on.result.callback(None)
+
+    async def _write_read_marker_if_newer(
+        self, room_id: str, user_id: str, event_id: str
+    ) -> None:
+        existing_read_marker = await self.store.get_account_data_for_room_and_type(
+            user_id, room_id, "m.fully_read"
+        )
+
+        should_update = True
+
+        if existing_read_marker:
+            # Only update if the new marker is ahead in the stream
+            should_update = await self.store.is_event_after(
+                event_id, existing_read_marker["event_id"]
+            )
+
+        if should_update:
+            content = {"event_id": event_id}
+            await self.account_data_handler.add_account_data_to_room(
+                user_id, room_id, "m.fully_read", content
+            )
@@ -1752,9 +1752,41 @@ class EventsWorkerStore(SQLBaseStore):
 
     async def is_event_after(self, event_id1: str, event_id2: str) -> bool:
         """Returns True if event_id1 is after event_id2 in the stream"""
-        to_1, so_1 = await self.get_event_ordering(event_id1)
-        to_2, so_2 = await self.get_event_ordering(event_id2)
-        return (to_1, so_1) > (to_2, so_2)
+        orderings = await self._get_event_orderings((event_id1, event_id2))
+        return orderings[event_id1] > orderings[event_id2]
+
+    @cachedList(cached_method_name="get_event_ordering", list_name="event_ids")
+    async def _get_event_orderings(
+        self, event_ids: Collection[str]
+    ) -> Dict[str, Tuple[int, int]]:
+        """Fetch the orderings of the given events in a single query, filling
+        the `get_event_ordering` cache.
+
+        Raises:
+            SynapseError if any of the events are unknown. We raise rather than
+            returning a partial result so that `@cachedList` does not cache the
+            missing events as `None`.
+        """
+        rows = await self.db_pool.simple_select_many_batch(
+            table="events",
+            column="event_id",
+            iterable=event_ids,
+            retcols=["event_id", "topological_ordering", "stream_ordering"],
+            desc="get_event_orderings",
+        )
+        orderings = {
+            row["event_id"]: (
+                int(row["topological_ordering"]),
+                int(row["stream_ordering"]),
+            )
+            for row in rows
+        }
+
+        for event_id in event_ids:
+            if event_id not in orderings:
+                raise SynapseError(404, "Could not find event %s" % (event_id,))
+
+        return orderings
 
     @cached(max_entries=5000)
     async def get_event_ordering(self, event_id: str) -> Tuple[int, int]:
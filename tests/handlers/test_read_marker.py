@@ -0,0 +1,293 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Any, List, Tuple
+from unittest.mock import Mock, patch
+
+from twisted.internet import defer
+from twisted.test.proto_helpers import MemoryReactor
+
+from synapse.api.constants import ReceiptTypes
+from synapse.api.errors import SynapseError
+from synapse.logging.context import make_deferred_yieldable
+from synapse.rest import admin
+from synapse.rest.client import login, room
+from synapse.server import HomeServer
+from synapse.util import Clock
+
+from tests import unittest
+from tests.test_utils import make_awaitable
+
+
+class ReadMarkerTestCase(unittest.HomeserverTestCase):
+    servlets = [
+        admin.register_servlets,
+        login.register_servlets,
+        room.register_servlets,
+    ]
+
+    def prepare(self, reactor: MemoryReactor, clock: Clock, hs: HomeServer) -> None:
+        self.handler = hs.get_read_marker_handler()
+        self.store = hs.get_datastores().main
+
+        self.user_id = self.register_user("user", "pass")
+        self.tok = self.login("user", "pass")
+        self.room_id = self.helper.create_room_as(self.user_id, tok=self.tok)
+
+    def _get_read_marker(self) -> str:
+        content = self.get_success(
+            self.store.get_account_data_for_room_and_type(
+                self.user_id, self.room_id, ReceiptTypes.FULLY_READ
+            )
+        )
+        assert content is not None
+        return content["event_id"]
+
+    def test_read_marker_only_moves_forward(self) -> None:
+        """Tests that an older event does not overwrite a newer read marker."""
+        first = self.helper.send(self.room_id, "first", tok=self.tok)["event_id"]
+        second = self.helper.send(self.room_id, "second", tok=self.tok)["event_id"]
+
+        self.get_success(
+            self.handler.received_client_read_marker(self.room_id, self.user_id, second)
+        )
+        self.assertEqual(self._get_read_marker(), second)
+
+        self.get_success(
+            self.handler.received_client_read_marker(self.room_id, self.user_id, first)
+        )
+        self.assertEqual(self._get_read_marker(), second)
+
+    def test_resending_read_marker_skips_lock(self) -> None:
+        """Tests that re-sending the current read marker doesn't take the lock."""
+        event_id = self.helper.send(self.room_id, "hello", tok=self.tok)["event_id"]
+        self.get_success(
+            self.handler.received_client_read_marker(
+                self.room_id, self.user_id, event_id
+            )
+        )
+
+        # Check this also holds when the marker isn't in the account data cache,
+        # e.g. after a restart.
+        self.store.get_account_data_for_room_and_type.invalidate_all()
+
+        with patch.object(self.handler.read_marker_linearizer, "queue") as queue:
+            self.get_success(
+                self.handler.received_client_read_marker(
+                    self.room_id, self.user_id, event_id
+                )
+            )
+            queue.assert_not_called()
+
+    def test_resending_read_marker_after_purge(self) -> None:
+        """Tests that re-sending a read marker after the user's account data has
+        been purged (e.g. on deactivation) writes it again.
+        """
+        event_id = self.helper.send(self.room_id, "hello", tok=self.tok)["event_id"]
+        self.get_success(
+            self.handler.received_client_read_marker(
+                self.room_id, self.user_id, event_id
+            )
+        )
+
+        self.get_success(self.store.purge_account_data_for_user(self.user_id))
+        self.assertIsNone(
+            self.get_success(
+                self.store.get_account_data_for_room_and_type(
+                    self.user_id, self.room_id, ReceiptTypes.FULLY_READ
+                )
+            )
+        )
+
+        self.get_success(
+            self.handler.received_client_read_marker(
+                self.room_id, self.user_id, event_id
+            )
+        )
+        self.assertEqual(self._get_read_marker(), event_id)
+
+    def test_unknown_event(self) -> None:
+        """Tests that advancing the read marker to an unknown event fails, and
+        that the unknown event is not cached.
+        """
+        event_id = self.helper.send(self.room_id, "hello", tok=self.tok)["event_id"]
+        self.get_success(
+            self.handler.received_client_read_marker(
+                self.room_id, self.user_id, event_id
+            )
+        )
+
+        failure = self.get_failure(
+            self.handler.received_client_read_marker(
+                self.room_id, self.user_id, "$unknown:test"
+            ),
+            SynapseError,
+        )
+        self.assertEqual(failure.value.code, 404)
+        self.assertEqual(self._get_read_marker(), event_id)
+
+        self.get_failure(self.store.get_event_ordering("$unknown:test"), SynapseError)
+
+    def test_identical_concurrent_updates_are_coalesced(self) -> None:
+        """Tests that concurrent updates to the same event only write once."""
+        event_id = self.helper.send(self.room_id, "hello", tok=self.tok)["event_id"]
+
+        write_deferred: "defer.Deferred[int]" = defer.Deferred()
+        add_account_data = Mock(
+            side_effect=lambda *args: make_deferred_yieldable(write_deferred)
+        )
+        self.handler.account_data_handler.add_account_data_to_room = add_account_data  # type: ignore[assignment]
+
+        d1 = defer.ensureDeferred(
+            self.handler.received_client_read_marker(
+                self.room_id, self.user_id, event_id
+            )
+        )
+        d2 = defer.ensureDeferred(
+            self.handler.received_client_read_marker(
+                self.room_id, self.user_id, event_id
+            )
+        )
+        self.pump()
+
+        add_account_data.assert_called_once_with(
+            self.user_id, self.room_id, "m.fully_read", {"event_id": event_id}
+        )
+        self.assertFalse(d1.called)
+        self.assertFalse(d2.called)
+
+        write_deferred.callback(1)
+        self.get_success(d1)
+        self.get_success(d2)
+        add_account_data.assert_called_once()
+
+    def _queue_behind_stale_write(
+        self, event_ids: List[str], next_write: Any = None
+    ) -> Tuple[Mock, List["defer.Deferred[None]"]]:
+        """Sends a read marker update for each of the given events, holding the
+        lock with the first write until the rest of the updates are stale.
+
+        Args:
+            event_ids: The events to send read marker updates for.
+            next_write: If set, an exception for the second write to raise.
+
+        Returns:
+            The mocked `add_account_data_to_room`, and the deferreds for each
+            update, which have not yet been run to completion.
+        """
+        write_deferred: "defer.Deferred[int]" = defer.Deferred()
+        add_account_data = Mock(
+            side_effect=[
+                make_deferred_yieldable(write_deferred),
+                next_write or make_awaitable(1),
+            ]
+        )
+        self.handler.account_data_handler.add_account_data_to_room = add_account_data  # type: ignore[assignment]
+
+        deferreds = [
+            defer.ensureDeferred(
+                self.handler.received_client_read_marker(
+                    self.room_id, self.user_id, event_id
+                )
+            )
+            for event_id in event_ids
+        ]
+        self.pump()
+        add_account_data.assert_called_once()
+
+        # Hold the lock past the deadline, then let the other updates through.
+        self.reactor.advance(10)
+        write_deferred.callback(1)
+
+        return add_account_data, deferreds
+
+    def test_stale_update_is_handed_on(self) -> None:
+        """Tests that an update which waited too long for the lock is handed on to
+        a later update for the same user queued behind it.
+        """
+        first, second, third = (
+            self.helper.send(self.room_id, body, tok=self.tok)["event_id"]
+            for body in ("first", "second", "third")
+        )
+
+        add_account_data, deferreds = self._queue_behind_stale_write(
+            [first, second, third]
+        )
+        for d in deferreds:
+            self.get_success(d)
+
+        self.assertEqual(add_account_data.call_count, 2)
+        add_account_data.assert_called_with(
+            self.user_id, self.room_id, "m.fully_read", {"event_id": third}
+        )
+
+    def test_stale_update_is_not_lost_to_older_update(self) -> None:
+        """Tests that a stale update handed on to a later update for an older
+        event still wins.
+        """
+        first, second, third = (
+            self.helper.send(self.room_id, body, tok=self.tok)["event_id"]
+            for body in ("first", "second", "third")
+        )
+
+        add_account_data, deferreds = self._queue_behind_stale_write(
+            [first, third, second]
+        )
+        for d in deferreds:
+            self.get_success(d)
+
+        self.assertEqual(add_account_data.call_count, 2)
+        add_account_data.assert_called_with(
+            self.user_id, self.room_id, "m.fully_read", {"event_id": third}
+        )
+
+    def test_stale_update_written_when_next_update_is_unknown(self) -> None:
+        """Tests that an event handed on to an update for an unknown event is still
+        written before the stale update returns.
+        """
+        first, second = (
+            self.helper.send(self.room_id, body, tok=self.tok)["event_id"]
+            for body in ("first", "second")
+        )
+
+        add_account_data, deferreds = self._queue_behind_stale_write(
+            [first, second, "$unknown:test"]
+        )
+        self.get_success(deferreds[0])
+        self.get_success(deferreds[1])
+        self.get_failure(deferreds[2], SynapseError)
+
+        self.assertEqual(add_account_data.call_count, 2)
+        add_account_data.assert_called_with(
+            self.user_id, self.room_id, "m.fully_read", {"event_id": second}
+        )
+
+    def test_stale_update_fails_with_next_update(self) -> None:
+        """Tests that a stale update fails if the write it was handed on to fails."""
+        first, second, third = (
+            self.helper.send(self.room_id, body, tok=self.tok)["event_id"]
+            for body in ("first", "second", "third")
+        )
+
+        add_account_data, deferreds = self._queue_behind_stale_write(
+            [first, second, third], next_write=Exception("Failed to write")
+        )
+        self.get_success(deferreds[0])
+        self.get_failure(deferreds[1], Exception)
+        self.get_failure(deferreds[2], Exception)
+
+        self.assertEqual(add_account_data.call_count, 2)
+        add_account_data.assert_called_with(
+            self.user_id, self.room_id, "m.fully_read", {"event_id": third}
+        )